@@ -1,10 +1,17 @@
 # check_api_keys_streamlit.py
 # App en Streamlit para probar varias API keys de https://api.api-tennis.com/
 
+import asyncio
+import json
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import httpx
 import requests
 import pandas as pd
 import streamlit as st
+from urllib3.util.retry import Retry
 
 # ==========================
 # Configuración de la página
@@ -48,6 +55,16 @@ timeout_sec = st.number_input(
     step=1.0,
 )
 
+force_refresh = st.checkbox(
+    "Forzar refresco (ignorar resultados cacheados)",
+    value=False,
+    help=(
+        "En lotes de hasta 32 keys los resultados se guardan 5 minutos; "
+        "marca esto para volver a probar todas las keys. Los lotes más "
+        "grandes (modo async) se prueban siempre en vivo."
+    ),
+)
+
 st.caption(
     "Se usa el método `get_events` porque sólo requiere `APIkey` (no fechas ni parámetros extra)."
 )
@@ -59,6 +76,39 @@ st.caption(
 # Ver doc: https://api.api-tennis.com/tennis/?method=get_events&APIkey=!_your_account_APIkey_!
 TEST_URL = "https://api.api-tennis.com/tennis/?method=get_events&APIkey={api_key}"
 
+# Marcador de éxito para el prefijo truncado: exige el delimitador tras el 1
+# para no confundir p. ej. success=10 con success=1.
+_SUCCESS_MARKER = re.compile(r'"success"\s*:\s*1\s*[,}]')
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """
+    Session compartida (singleton) con keep-alive hacia api.api-tennis.com.
+    Así sólo se paga el handshake TCP+TLS en el primer request; las keys
+    siguientes reutilizan la misma conexión.
+
+    Incluye retry con backoff para errores 5xx transitorios, que antes
+    marcaban una key válida como '❌ No' sin reintentar.
+    """
+    session = requests.Session()
+    retries = Retry(
+        total=2,
+        backoff_factor=0.3,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["GET"],
+        # Si los reintentos se agotan, devolver la respuesta 5xx en vez de
+        # lanzar RetryError (cuyo mensaje incluiría la URL con la key sin
+        # enmascarar); así el resultado pasa por _interpret_response.
+        raise_on_status=False,
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=32, pool_maxsize=32, max_retries=retries
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
 
 def mask_key(key: str, visible_start: int = 4, visible_end: int = 3) -> str:
     """Enmascara la API key para no mostrarla completa."""
@@ -68,7 +118,49 @@ def mask_key(key: str, visible_start: int = 4, visible_end: int = 3) -> str:
     return f"{key[:visible_start]}****{key[-visible_end:]}"
 
 
-def check_api_key(key: str, timeout: float = 10.0) -> dict:
+def _interpret_response(status_code: int, data, raw_text: str, elapsed: float) -> dict:
+    """
+    Interpreta el status HTTP y el JSON de get_events y arma el dict de
+    resultado. Compartida por las rutas sync y async para que los mensajes
+    y la lógica de success no diverjan entre ambas.
+    """
+    # Si no es 200, ya es error HTTP
+    if status_code != 200:
+        return {
+            "ok": False,
+            "status_code": status_code,
+            "elapsed": elapsed,
+            "msg": f"Error HTTP {status_code}",
+            "success_field": None,
+            "raw_error": raw_text[:300],  # recortado para debug
+        }
+
+    # Si es 200, revisar estructura de JSON
+    if isinstance(data, dict):
+        success_field = data.get("success")
+        # Según doc, success=1 significa OK
+        if success_field == 1:
+            msg = "OK (success=1, API key válida y método permitido)"
+            ok = True
+        else:
+            msg = f"Respuesta 200 pero success={success_field} (posible API key sin plan adecuado o error lógico)"
+            ok = False
+    else:
+        success_field = None
+        msg = "200 pero respuesta no es JSON válido o no es dict"
+        ok = False
+
+    return {
+        "ok": ok,
+        "status_code": status_code,
+        "elapsed": elapsed,
+        "msg": msg,
+        "success_field": success_field,
+        "raw_error": None if ok else raw_text[:300],
+    }
+
+
+def _probe_api_key(key: str, timeout: float) -> dict:
     """
     Hace un request a api.api-tennis.com para verificar una API key.
     Usa el método get_events (no requiere parámetros extra).
@@ -78,55 +170,174 @@ def check_api_key(key: str, timeout: float = 10.0) -> dict:
     t0 = time.time()
 
     try:
-        resp = requests.get(url, timeout=timeout)
-        elapsed = time.time() - t0
-        status_code = resp.status_code
-
-        raw_text = resp.text  # por si la respuesta no es JSON
-
-        # Intentar parsear JSON
-        data = None
+        resp = get_session().get(url, timeout=timeout, stream=True)
         try:
-            data = resp.json()
-        except Exception:
+            elapsed = time.time() - t0
+            status_code = resp.status_code
+
+            # Leer sólo el primer bloque (~8 KB): para validar la key basta
+            # con ver el campo success, no hace falta bajar la lista de
+            # eventos completa.
+            chunk = next(resp.iter_content(8192, decode_unicode=True), "")
+            if isinstance(chunk, bytes):
+                chunk = chunk.decode(resp.encoding or "utf-8", errors="replace")
+            raw_text = chunk or ""  # por si la respuesta no es JSON
+
+            # Intentar parsear JSON sobre el prefijo
             data = None
+            try:
+                data = json.loads(raw_text)
+            except Exception:
+                if status_code == 200 and _SUCCESS_MARKER.search(raw_text):
+                    # JSON truncado, pero el marcador de éxito ya apareció:
+                    # no hay que descargar el resto del cuerpo.
+                    data = {"success": 1}
+                else:
+                    # Prefijo no concluyente: leer el resto y reintentar
+                    for extra in resp.iter_content(8192, decode_unicode=True):
+                        if isinstance(extra, bytes):
+                            extra = extra.decode(
+                                resp.encoding or "utf-8", errors="replace"
+                            )
+                        raw_text += extra
+                    try:
+                        data = json.loads(raw_text)
+                    except Exception:
+                        data = None
+        finally:
+            resp.close()
+
+        return _interpret_response(status_code, data, raw_text, elapsed)
 
-        # Si no es 200, ya es error HTTP
-        if status_code != 200:
-            return {
-                "ok": False,
-                "status_code": status_code,
-                "elapsed": elapsed,
-                "msg": f"Error HTTP {status_code}",
-                "success_field": None,
-                "raw_error": raw_text[:300],  # recortado para debug
-            }
-
-        # Si es 200, revisar estructura de JSON
-        if isinstance(data, dict):
-            success_field = data.get("success")
-            # Según doc, success=1 significa OK
-            if success_field == 1:
-                msg = "OK (success=1, API key válida y método permitido)"
-                ok = True
-            else:
-                msg = f"Respuesta 200 pero success={success_field} (posible API key sin plan adecuado o error lógico)"
-                ok = False
-        else:
-            success_field = None
-            msg = "200 pero respuesta no es JSON válido o no es dict"
-            ok = False
-
+    except requests.exceptions.Timeout:
+        elapsed = time.time() - t0
         return {
-            "ok": ok,
-            "status_code": status_code,
+            "ok": False,
+            "status_code": None,
+            "elapsed": elapsed,
+            "msg": "Timeout (no hubo respuesta dentro del límite)",
+            "success_field": None,
+            "raw_error": None,
+        }
+    except Exception as e:
+        elapsed = time.time() - t0
+        return {
+            "ok": False,
+            "status_code": None,
             "elapsed": elapsed,
-            "msg": msg,
-            "success_field": success_field,
-            "raw_error": None if ok else raw_text[:300],
+            "msg": f"Excepción: {e}",
+            "success_field": None,
+            "raw_error": None,
         }
 
-    except requests.exceptions.Timeout:
+
+class _CheckFailed(Exception):
+    """Transporta un resultado fallido para mantenerlo fuera de la caché larga."""
+
+    def __init__(self, result: dict):
+        self.result = result
+
+
+@st.cache_data(ttl=10, show_spinner=False, max_entries=1024)
+def _check_api_key_short_ttl(key: str, timeout: float) -> dict:
+    """Caché corta (10 s): guarda cualquier resultado, bueno o malo."""
+    return _probe_api_key(key, timeout)
+
+
+@st.cache_data(ttl=300, show_spinner=False, max_entries=1024)
+def _check_api_key_long_ttl(key: str, timeout: float) -> dict:
+    """
+    Caché larga (5 min): sólo guarda resultados ok. Los fallos se relanzan
+    como excepción (st.cache_data no memoriza excepciones), así un timeout
+    o 5xx transitorio no deja una key válida marcada como '❌ No' 5 minutos.
+    """
+    result = _check_api_key_short_ttl(key, timeout)
+    if not result["ok"]:
+        raise _CheckFailed(result)
+    return result
+
+
+def check_api_key(key: str, timeout: float = 10.0) -> dict:
+    """
+    Verifica una API key con caché por (key, timeout): los éxitos se
+    recuerdan 5 minutos y los fallos sólo 10 segundos, para que un
+    re-click reintente pronto las keys que fallaron por algo transitorio.
+    """
+    try:
+        return _check_api_key_long_ttl(key, timeout)
+    except _CheckFailed as e:
+        return e.result
+
+
+# A partir de este número de keys usamos asyncio en vez del thread pool:
+# un solo event loop multiplexa todos los sockets y no hay que pagar
+# un hilo del SO por request.
+ASYNC_THRESHOLD = 32
+
+
+async def check_api_key_async(client: "httpx.AsyncClient", key: str, timeout: float) -> dict:
+    """
+    Versión async de check_api_key usando httpx, con las mismas
+    mitigaciones que la ruta sync: reintento con backoff ante 5xx
+    transitorios y lectura de sólo el prefijo del cuerpo (~8 KB).
+    Devuelve el mismo dict: ok, status_code, elapsed, msg, success_field, raw_error.
+    """
+    url = TEST_URL.format(api_key=key.strip())
+    t0 = time.time()
+    # pool=None: una key en cola esperando conexión libre no debe
+    # consumir su timeout antes de salir siquiera a la red.
+    httpx_timeout = httpx.Timeout(timeout, pool=None)
+
+    try:
+        # 1 intento + 2 reintentos con backoff 0.3·2^n, igual que la
+        # urllib3.Retry de la Session sync.
+        for attempt in range(3):
+            if attempt:
+                await asyncio.sleep(0.3 * (2 ** (attempt - 1)))
+
+            async with client.stream("GET", url, timeout=httpx_timeout) as resp:
+                elapsed = time.time() - t0
+                status_code = resp.status_code
+
+                if status_code in (502, 503, 504) and attempt < 2:
+                    continue
+
+                # Leer sólo el primer bloque (~8 KB): para validar la key
+                # basta con ver el campo success.
+                body = resp.aiter_bytes(8192)
+                raw_bytes = b""
+                async for chunk in body:
+                    raw_bytes += chunk
+                    if len(raw_bytes) >= 8192:
+                        break
+                raw_text = raw_bytes.decode(
+                    resp.encoding or "utf-8", errors="replace"
+                )  # por si la respuesta no es JSON
+
+                # Intentar parsear JSON sobre el prefijo
+                data = None
+                try:
+                    data = json.loads(raw_text)
+                except Exception:
+                    if status_code == 200 and _SUCCESS_MARKER.search(raw_text):
+                        # JSON truncado, pero el marcador de éxito ya
+                        # apareció: no hay que descargar el resto.
+                        data = {"success": 1}
+                    else:
+                        # Prefijo no concluyente: leer el resto y reintentar
+                        async for chunk in body:
+                            raw_bytes += chunk
+                        raw_text = raw_bytes.decode(
+                            resp.encoding or "utf-8", errors="replace"
+                        )
+                        try:
+                            data = json.loads(raw_text)
+                        except Exception:
+                            data = None
+
+                return _interpret_response(status_code, data, raw_text, elapsed)
+
+    except httpx.TimeoutException:
         elapsed = time.time() - t0
         return {
             "ok": False,
@@ -147,6 +358,26 @@ def check_api_key(key: str, timeout: float = 10.0) -> dict:
             "raw_error": None,
         }
 
+
+async def _check_keys_async(api_keys: list, timeout: float) -> list:
+    """
+    Lanza todas las verificaciones sobre un solo AsyncClient y devuelve
+    los resultados en el orden original de las keys.
+
+    El cliente se crea aquí (no en st.cache_resource) porque cada
+    asyncio.run() usa un event loop nuevo y un cliente cacheado quedaría
+    atado a un loop ya cerrado en el siguiente rerun.
+    """
+    limits = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    # retries=2 cubre fallos de conexión (reset, DNS); los 5xx los
+    # reintenta check_api_key_async.
+    transport = httpx.AsyncHTTPTransport(retries=2)
+    async with httpx.AsyncClient(limits=limits, transport=transport) as client:
+        return await asyncio.gather(
+            *(check_api_key_async(client, key, timeout) for key in api_keys)
+        )
+
+
 # ==========================
 # Lógica principal
 # ==========================
@@ -161,16 +392,49 @@ if st.button("🚀 Probar API keys"):
     else:
         st.info(f"Probando {len(api_keys)} API key(s)…")
 
+        if force_refresh:
+            _check_api_key_long_ttl.clear()
+            _check_api_key_short_ttl.clear()
+
         progress_bar = st.progress(0)
         status_placeholder = st.empty()
 
+        # Probar todas las keys en paralelo: el trabajo es puro I/O de red,
+        # así el tiempo total pasa de sumar latencias a ~la latencia más lenta.
+        results_by_idx = {}
+
+        if len(api_keys) > ASYNC_THRESHOLD:
+            # Lotes grandes: un event loop escala a cientos de keys sin
+            # abrir un hilo por request.
+            status_placeholder.write(
+                f"Probando {len(api_keys)} keys en modo async…"
+            )
+            async_results = asyncio.run(_check_keys_async(api_keys, timeout_sec))
+            for idx, (key, result) in enumerate(zip(api_keys, async_results)):
+                results_by_idx[idx] = (key, result)
+            progress_bar.progress(1.0)
+        else:
+            max_workers = min(len(api_keys), 16)
+
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                futures = {
+                    pool.submit(check_api_key, key, timeout_sec): (idx, key)
+                    for idx, key in enumerate(api_keys)
+                }
+                for done_count, future in enumerate(as_completed(futures), start=1):
+                    idx, key = futures[future]
+                    results_by_idx[idx] = (key, future.result())
+                    status_placeholder.write(
+                        f"Probadas {done_count}/{len(api_keys)} keys…"
+                    )
+                    progress_bar.progress(done_count / len(api_keys))
+
         results = []
         debug_rows = []
 
-        for idx, key in enumerate(api_keys, start=1):
-            status_placeholder.write(f"Probando key {idx}/{len(api_keys)}…")
-
-            result = check_api_key(key, timeout=timeout_sec)
+        # Volcar resultados en el orden original de las keys pegadas
+        for idx in range(len(api_keys)):
+            key, result = results_by_idx[idx]
 
             results.append(
                 {
@@ -195,8 +459,6 @@ if st.button("🚀 Probar API keys"):
                     }
                 )
 
-            progress_bar.progress(idx / len(api_keys))
-
         status_placeholder.write("Prueba finalizada ✔")
 
         df = pd.DataFrame(results)